@@ -1,11 +1,18 @@
+import io
 import os
+import random
+import re
 import json
 import logging
 import secrets
 import asyncio
 from datetime import datetime
+from functools import lru_cache
 import pytz
-from collections import defaultdict, deque
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
+import ahocorasick
 
 from fastapi import FastAPI, Request, Response, HTTPException
 from telegram import Update, Bot
@@ -13,9 +20,15 @@ from telegram.ext import Application, CommandHandler, MessageHandler, filters, C
 from telegram.constants import ChatAction
 from dotenv import load_dotenv
 from groq import Groq
-import whisper
+from fast_langdetect import detect
+from faster_whisper import WhisperModel, decode_audio
+from faster_whisper.audio import pad_or_trim
+from faster_whisper.tokenizer import Tokenizer
+from faster_whisper.transcribe import get_compression_ratio
 from gtts import gTTS
-import requests
+import httpx
+import redis
+from redis.asyncio import Redis
 
 # --- Initial Setup & Configuration ---
 
@@ -27,6 +40,23 @@ load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
+# Whisper model size and CTranslate2 weight type. On low-RAM hosts use "tiny"
+# (about a third of "base") and keep int8, the smallest type CTranslate2 runs on CPU.
+WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "base")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+# Voice messages up to one Whisper window long that arrive within a short gather
+# window are transcribed together, with one batched encoder and decoder pass.
+WHISPER_SAMPLE_RATE = 16000
+WHISPER_CHUNK_SAMPLES = 30 * WHISPER_SAMPLE_RATE
+WHISPER_MAX_BATCH_SIZE = 4
+WHISPER_BATCH_WINDOW_SECONDS = 0.01
+# faster-whisper's own thresholds: a batched result that looks repetitive or unsure
+# is redone through the full transcribe() path (VAD and temperature fallback).
+WHISPER_COMPRESSION_RATIO_THRESHOLD = 2.4
+WHISPER_LOG_PROB_THRESHOLD = -1.0
+WHISPER_NO_SPEECH_THRESHOLD = 0.6
+# Redis instance holding conversation history, shared by every worker.
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost")
 # A secret token to secure the webhook, preventing unauthorized requests.
 WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", secrets.token_hex(16))
 
@@ -41,16 +71,93 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# --- In-Memory Cache for Conversation History ---
-# For a production system, this would be replaced with Redis or a similar cache.
-# Stores the last 2 interactions for each user.
-conversation_history = defaultdict(lambda: deque(maxlen=4)) # Stores (user_msg, bot_msg) pairs
+# --- Local Language Identification ---
+# fastText language IDs for the languages NomadAI has a persona for.
+ISO_LANGUAGE_NAMES = {"en": "english", "hi": "hindi", "fr": "french", "es": "spanish"}
+LANGDETECT_MAX_CHARS = 80
+# Below this confidence (or for an unmapped language) we let the LLM decide.
+LANGDETECT_MIN_CONFIDENCE = 0.5
+
+# --- Personas ---
+# Keyed on the first word of the detected language (e.g. "hindi" for "hindi (romanized)").
+PERSONA_INSTRUCTION_MAP = {
+    "hindi": "Your persona is 'Dilli Dost'. You are a witty, friendly best friend. You MUST speak in Hinglish... Be enthusiastic and informal.",
+    "hinglish": "Your persona is 'Dilli Dost'. You are a witty, friendly best friend. You MUST speak in Hinglish... Be enthusiastic and informal.",
+    "french": "Your persona is 'Votre ami à Delhi'. Be warm, encouraging, and polite...",
+    "spanish": "Your persona is 'Tu amigo en Delhi'. Be friendly, enthusiastic, and helpful...",
+}
+DEFAULT_PERSONA_INSTRUCTION = "Your persona is a friendly and knowledgeable local guide. Be clear, helpful, and welcoming..."
+LANG_CODE_MAP = {"hindi": "hi", "hinglish": "hi", "french": "fr", "spanish": "es"}
+
+# Pure greetings are answered from these templates without any LLM or Places call.
+GREETING_PATTERN = re.compile(
+    r"\W*(?P<greeting>hi|hello|hey|namaste|hola|bonjour|salut|नमस्ते)"
+    r"(?:\s+(?P<address>there|nomad\s?ai|friend|dost|ji|amigo|ami))?\W*",
+    re.IGNORECASE,
+)
+# Template language implied by the greeting word itself; fastText can't reliably
+# identify a word or two. Hindi greetings get Hinglish, matching the Hindi persona.
+GREETING_LANGUAGES = {
+    "hi": "english", "hello": "english", "hey": "english",
+    "namaste": "hinglish", "नमस्ते": "hinglish",
+    "hola": "spanish", "bonjour": "french", "salut": "french",
+}
+# A language-specific form of address ("hey dost", "hi amigo") overrides an English greeting word.
+GREETING_ADDRESS_LANGUAGES = {"dost": "hinglish", "ji": "hinglish", "amigo": "spanish", "ami": "french"}
+GREETINGS = {
+    "english": ["Hey there! What's the plan in Delhi today?", "Hello! Where in Delhi shall we go today?"],
+    "hinglish": ["Aur bhai! Kya scene hai aaj Delhi mein?", "Arre dost! Batao, aaj Delhi mein kahan chalna hai?"],
+    "french": ["Salut ! Qu'est-ce qu'on fait à Delhi aujourd'hui ?", "Bonjour ! On explore quel coin de Delhi aujourd'hui ?"],
+    "spanish": ["¡Hola! ¿Qué plan tienes hoy en Delhi?", "¡Hola, amigo! ¿A dónde vamos hoy en Delhi?"],
+}
+
+# --- Streaming Response Delivery ---
+# Sentence boundaries (including the Hindi danda) at which a streamed reply is handed to TTS.
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?\u0964])\s+")
+# Very short sentences are merged with the next one instead of becoming their own voice note.
+MIN_SPOKEN_CHUNK_CHARS = 40
+
+# --- Conversation History & Places Cache ---
+# History lives in Redis as a per-chat list of pre-formatted exchanges, newest first,
+# so it survives restarts and is shared across workers.
+HISTORY_MAX_EXCHANGES = 4
+HISTORY_TTL_SECONDS = 3600
+
+# Google Places results keyed by normalized query, shared across users for an hour.
+places_cache = TTLCache(maxsize=1024, ttl=3600)
+# In-flight lookups by normalized query, so concurrent misses share one upstream call and its result.
+places_inflight: dict[str, asyncio.Task] = {}
+# Overall deadline for one Places lookup; httpx's own timeout only bounds each connect/read step.
+PLACES_TIMEOUT_SECONDS = 5
+
+def normalize_query(text: str) -> str:
+    """Case-folds and collapses whitespace so equivalent queries compare equal."""
+    return " ".join(text.casefold().split())
 
 # --- Initialize Clients & Load Data ---
 try:
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
     groq_client = Groq(api_key=GROQ_API_KEY)
-    whisper_model = whisper.load_model("base")
+    # CTranslate2 int8 weights by default: roughly half the memory and faster CPU inference than FP32.
+    whisper_model = WhisperModel(
+        WHISPER_MODEL_SIZE, device="cpu", compute_type=WHISPER_COMPUTE_TYPE, cpu_threads=os.cpu_count()
+    )
+    # A single dedicated worker keeps transcriptions off the shared default pool
+    # (used by TTS, Groq, etc.) and always runs the model from the same thread.
+    whisper_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+    # Pending (audio, future) pairs waiting for the batcher.
+    whisper_queue: asyncio.Queue = asyncio.Queue()
+
+    # Short socket timeouts so an unreachable Redis costs under a second, not an OS TCP timeout.
+    redis_client = Redis.from_url(
+        REDIS_URL, decode_responses=True, socket_connect_timeout=0.5, socket_timeout=0.5
+    )
+
+    # One pooled keep-alive client so Places calls skip the TCP+TLS handshake after the first.
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        timeout=5.0,
+        http2=True,
+    )
 
     with open('delhi_secrets.json', 'r', encoding='utf-8') as f:
         delhi_secrets = json.load(f)
@@ -62,8 +169,17 @@ except Exception as e:
     logger.critical(f"Failed to initialize a critical service: {e}")
     raise
 
+# Aho-Corasick automaton over normalized landmark names, so a single pass over
+# the query finds any mentioned landmark regardless of how many tips we have.
+secrets_automaton = ahocorasick.Automaton()
+for place, data in delhi_secrets.items():
+    secrets_automaton.add_word(normalize_query(place), (place, data))
+if delhi_secrets:
+    secrets_automaton.make_automaton()
+
 # --- FastAPI App Initialization ---
 app = FastAPI()
+# Built once and reused for every update, so its Bot and HTTP connection pool are shared.
 telegram_app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
 
 
@@ -75,15 +191,32 @@ async def get_current_time_in_delhi() -> str:
     now = datetime.now(delhi_tz)
     return now.strftime("%A, %I:%M %p")
 
-async def detect_language_and_vibe(text: str) -> (str, str):
-    """Detects language and infers user vibe in a single, efficient LLM call."""
+def detect_language(text: str) -> str | None:
+    """Identifies the language locally with fastText. Returns None when unsure."""
+    try:
+        result = detect(text[:LANGDETECT_MAX_CHARS].replace("\n", " "))
+    except Exception as e:
+        logger.error(f"Error in local language detection: {e}")
+        return None
+    if result["score"] < LANGDETECT_MIN_CONFIDENCE:
+        return None
+    return ISO_LANGUAGE_NAMES.get(result["lang"])
+
+async def detect_language_and_vibe_intent(text: str) -> dict:
+    """Detects language locally, then infers vibe and location intent in one small LLM call."""
+    result = {"language": "english", "vibe": "neutral", "is_location_query": False, "search_query": None}
     if not text.strip():
-        return "english", "neutral"
+        return result
+    language = detect_language(text)
     try:
+        # Only ask the LLM for the language when fastText wasn't confident.
+        language_instruction = "" if language else """
+        - "language": The detected language of the text in lowercase (e.g., "english", "hindi")."""
         prompt = f"""
-        Analyze the following user query. Respond with a JSON object containing two keys:
-        1. "language": The detected language of the text in lowercase (e.g., "english", "hindi").
-        2. "vibe": Your best guess for the user's mood or intent. Choose one from: ["adventurous", "relaxed", "hungry", "curious", "in_a_hurry", "social", "neutral"].
+        Analyze the following user query. Respond with a JSON object containing these keys:{language_instruction}
+        - "vibe": Your best guess for the user's mood or intent. Choose one from: ["adventurous", "relaxed", "hungry", "curious", "in_a_hurry", "social", "neutral"].
+        - "is_location_query": true if answering needs places to go, eat, or visit in Delhi; false for greetings, thanks, or follow-ups answerable from the conversation.
+        - "search_query": If "is_location_query" is true, a short English Google Maps search for the query (e.g., "biryani near Jama Masjid"); otherwise null.
 
         User Query: "{text}"
         """
@@ -94,47 +227,73 @@ async def detect_language_and_vibe(text: str) -> (str, str):
             temperature=0.1,
             response_format={"type": "json_object"},
         )
-        result = json.loads(chat_completion.choices[0].message.content)
-        language = result.get("language", "english")
-        vibe = result.get("vibe", "neutral")
-        return language, vibe
+        analysis = json.loads(chat_completion.choices[0].message.content)
+        result["language"] = language or (analysis.get("language") or "").strip().lower() or "english"
+        # The model's JSON is untrusted: accept only real booleans and non-empty strings.
+        vibe = analysis.get("vibe")
+        result["vibe"] = vibe if isinstance(vibe, str) and vibe.strip() else "neutral"
+        is_location_query = analysis.get("is_location_query")
+        result["is_location_query"] = is_location_query if isinstance(is_location_query, bool) else True
+        search_query = analysis.get("search_query")
+        result["search_query"] = search_query.strip() if isinstance(search_query, str) and search_query.strip() else text
     except Exception as e:
-        logger.error(f"Error in language/vibe detection: {e}")
-        return "english", "neutral"
+        logger.error(f"Error in language/vibe/intent detection: {e}")
+        # Without an intent we can't safely skip Places, so treat it as a location query.
+        result["language"] = language or "english"
+        result["is_location_query"] = True
+        result["search_query"] = text
+    return result
 
 async def get_places_data(query: str) -> str:
-    """Fetches real-time data from Google Maps Places API asynchronously."""
-    url = f"https://maps.googleapis.com/maps/api/place/textsearch/json?query={requests.utils.quote(query)} in Delhi&key={GOOGLE_MAPS_API_KEY}"
+    """Fetches real-time data from Google Maps Places API, served from cache when possible."""
+    key = normalize_query(query)
+    cached = places_cache.get(key)
+    if cached is not None:
+        return cached
+    task = places_inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(fetch_places_data(query, key))
+        places_inflight[key] = task
+        task.add_done_callback(lambda _: places_inflight.pop(key, None))
+    # Shielded so one caller giving up doesn't cancel the lookup for everyone else.
+    return await asyncio.shield(task)
+
+async def fetch_places_data(query: str, cache_key: str) -> str:
+    """Queries Google Maps Places API and caches the formatted result when the lookup succeeds."""
     try:
-        # Using asyncio-compatible HTTP library would be ideal, but for this scope,
-        # running requests in a thread pool is a good compromise.
-        loop = asyncio.get_running_loop()
-        response = await loop.run_in_executor(None, lambda: requests.get(url, timeout=5))
+        response = await asyncio.wait_for(
+            http_client.get(
+                "https://maps.googleapis.com/maps/api/place/textsearch/json",
+                params={"query": f"{query} in Delhi", "key": GOOGLE_MAPS_API_KEY},
+            ),
+            timeout=PLACES_TIMEOUT_SECONDS,
+        )
         response.raise_for_status()
-        data = response.json().get('results', [])
+        payload = response.json()
+        # Quota and auth failures arrive as HTTP 200 with an error status and no results.
+        status = payload.get('status')
+        if status not in ("OK", "ZERO_RESULTS"):
+            logger.error(f"Google Places returned status {status}: {payload.get('error_message', '')}")
+            return "Sorry, I couldn't fetch live location data right now."
+        data = payload.get('results', [])
         if not data:
-            return "No relevant places found."
-        return "\n".join([
-            f"- Name: {place.get('name')}, Rating: {place.get('rating', 'N/A')}"
-            for place in data[:3]
-        ])
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching Google Places data: {e}")
+            formatted_data = "No relevant places found."
+        else:
+            formatted_data = "\n".join([
+                f"- Name: {place.get('name')}, Rating: {place.get('rating', 'N/A')}"
+                for place in data[:3]
+            ])
+        places_cache[cache_key] = formatted_data
+        return formatted_data
+    except (httpx.HTTPError, asyncio.TimeoutError, ValueError) as e:
+        # ValueError covers a non-JSON body (proxy or captive-portal HTML).
+        logger.error(f"Error fetching Google Places data: {e!r}")
         return "Sorry, I couldn't fetch live location data right now."
 
-def generate_master_prompt(language: str, user_query: str, places_data: str, history: list, time_info: str, vibe: str) -> str:
-    """Generates the advanced, context-aware prompt for the main LLM call."""
-    secret_tip = "No specific insider tip found for this query."
-    for place, data in delhi_secrets.items():
-        if place.lower() in user_query.lower():
-            secret_tip = f"Insider Tip for {place}: {data.get('universal_tip', '')}"
-            if 'warning' in data:
-                secret_tip += f" (Warning: {data['warning']})"
-            break
-    
-    formatted_history = "\n".join([f"User: {h[0]}\nBot: {h[1]}" for h in history])
-    persona_instruction = persona_instruction_map.get(language, persona_instruction_map["default"])
-
+@lru_cache(maxsize=256)
+def persona_header(language: str, vibe: str, time_info: str) -> str:
+    """Builds the fixed opening of the master prompt; identical for every request in the same minute."""
+    persona_instruction = PERSONA_INSTRUCTION_MAP.get(language.split()[0], DEFAULT_PERSONA_INSTRUCTION)
     return f"""
     You are NomadAI, an expert, friendly local guide for Delhi. Your personality MUST adapt based on the user's language.
     Your knowledge is your own; do not mention that you are using Google Maps or a database.
@@ -145,15 +304,29 @@ def generate_master_prompt(language: str, user_query: str, places_data: str, his
     - Detected Language: {language}
     - Your Persona: {persona_instruction}
 
-    **Conversation History (for context):**
-    {formatted_history if formatted_history else "This is the beginning of the conversation."}
-
     **Your Task:**
     1. Based on the **Current User Query** below, and all the context provided, generate a helpful, conversational response.
     2. Respond ONLY in fluent, natural-sounding `{language}`.
     3. Synthesize [Live Data] and [Secret Tip] into your response. Don't just list them.
     4. Your recommendation should be appropriate for the current time and the user's vibe.
     5. If the query is a follow-up, use the conversation history to understand it (e.g., "how do I get there?").
+"""
+
+def generate_master_prompt(language: str, user_query: str, places_data: str, history: str, time_info: str, vibe: str, is_location_query: bool = True) -> str:
+    """Generates the advanced, context-aware prompt for the main LLM call."""
+    secret_tip = "No specific insider tip found for this query."
+    if is_location_query and delhi_secrets:
+        hit = next(secrets_automaton.iter(normalize_query(user_query)), None)
+        if hit:
+            _, (place, data) = hit
+            secret_tip = f"Insider Tip for {place}: {data.get('universal_tip', '')}"
+            if 'warning' in data:
+                secret_tip += f" (Warning: {data['warning']})"
+    
+    # The shared header comes first so identical prompt prefixes can be reused by Groq's prompt cache.
+    return persona_header(language, vibe, time_info) + f"""
+    **Conversation History (for context):**
+    {history if history else "This is the beginning of the conversation."}
 
     ---
     **[Live Data]:** {places_data}
@@ -165,46 +338,227 @@ def generate_master_prompt(language: str, user_query: str, places_data: str, his
     Now, act as their friend and respond.
     """
 
-def get_ai_response(prompt: str) -> str:
-    """Gets the final, synthesized response from the powerful LLM."""
+def match_greeting(text: str) -> re.Match | None:
+    """Matches queries that are just a greeting, like "hey there!" or "namaste"."""
+    return GREETING_PATTERN.fullmatch(text.strip())
+
+def greeting_language(greeting: re.Match) -> str:
+    """Picks the template language from the matched greeting and form of address."""
+    address = (greeting.group("address") or "").lower()
+    return GREETING_ADDRESS_LANGUAGES.get(address) or GREETING_LANGUAGES[greeting.group("greeting").lower()]
+
+async def greeting_reply(language: str):
+    """Yields a templated greeting in the user's language, shaped like stream_ai_response."""
+    yield random.choice(GREETINGS.get(language.split()[0], GREETINGS["english"]))
+
+def pop_sentences(buffer: str) -> tuple[list[str], str]:
+    """Splits complete sentences off the front of a streaming buffer, returning them and the remainder."""
+    *complete, remainder = SENTENCE_BOUNDARY.split(buffer)
+    sentences, current = [], ""
+    for piece in complete:
+        current = f"{current} {piece}" if current else piece
+        if len(current) >= MIN_SPOKEN_CHUNK_CHARS:
+            sentences.append(current)
+            current = ""
+    return sentences, f"{current} {remainder}" if current else remainder
+
+async def stream_ai_response(prompt: str):
+    """Streams the final response from the powerful LLM, yielding it sentence by sentence."""
+    loop = asyncio.get_running_loop()
+    deltas: asyncio.Queue = asyncio.Queue()
+
+    def _produce() -> None:
+        # The Groq client is synchronous, so iterate the stream in a worker thread
+        # and hand each delta back to the event loop.
+        streamed_any = False
+        try:
+            stream = groq_client.chat.completions.create(
+                messages=[{"role": "system", "content": prompt}],
+                model="llama3-70b-8192",
+                stream=True,
+            )
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    streamed_any = True
+                    loop.call_soon_threadsafe(deltas.put_nowait, delta)
+        except Exception as e:
+            logger.error(f"Error getting AI response: {e}")
+            if not streamed_any:
+                loop.call_soon_threadsafe(
+                    deltas.put_nowait,
+                    "I'm sorry, I'm having a little trouble thinking right now. Please try again in a moment.",
+                )
+        finally:
+            loop.call_soon_threadsafe(deltas.put_nowait, None)
+
+    producer = loop.run_in_executor(None, _produce)
+    pending = ""
+    while (delta := await deltas.get()) is not None:
+        sentences, pending = pop_sentences(pending + delta)
+        for sentence in sentences:
+            yield sentence
+    await producer
+    if pending.strip():
+        yield pending.strip()
+
+# --- Conversation History Functions ---
+
+async def get_history(chat_id: int) -> str:
+    """Returns the chat's recent exchanges, oldest first, formatted for the prompt."""
     try:
-        chat_completion = groq_client.chat.completions.create(
-            messages=[{"role": "system", "content": prompt}],
-            model="llama3-70b-8192",
-        )
-        return chat_completion.choices[0].message.content
-    except Exception as e:
-        logger.error(f"Error getting AI response: {e}")
-        return "I'm sorry, I'm having a little trouble thinking right now. Please try again in a moment."
+        exchanges = await redis_client.lrange(f"h:{chat_id}", 0, HISTORY_MAX_EXCHANGES - 1)
+    except redis.RedisError as e:
+        logger.error(f"Error reading conversation history: {e}")
+        return ""
+    return "\n".join(reversed(exchanges))
+
+async def append_history(chat_id: int, user_msg: str, bot_msg: str) -> None:
+    """Records an exchange, trims the chat to its rolling window, and refreshes its expiry in one round-trip."""
+    key = f"h:{chat_id}"
+    try:
+        async with redis_client.pipeline() as pipe:
+            await (
+                pipe.lpush(key, f"User: {user_msg}\nBot: {bot_msg}")
+                .ltrim(key, 0, HISTORY_MAX_EXCHANGES - 1)
+                .expire(key, HISTORY_TTL_SECONDS)
+                .execute()
+            )
+    except redis.RedisError as e:
+        logger.error(f"Error saving conversation history: {e}")
+
+async def clear_history(chat_id: int) -> None:
+    """Forgets the chat's conversation history."""
+    try:
+        await redis_client.delete(f"h:{chat_id}")
+    except redis.RedisError as e:
+        logger.error(f"Error clearing conversation history: {e}")
 
 # --- Audio Processing Functions ---
 
-async def transcribe_voice(audio_file_path: str) -> str:
-    """Transcribes audio file to text using Whisper in a separate thread."""
+def transcribe_batch(clips: list[np.ndarray]) -> list[str]:
+    """Transcribes clips of at most 30 s together with one batched encoder and decoder pass."""
+    features = np.stack([pad_or_trim(whisper_model.feature_extractor(clip)[..., :-1]) for clip in clips])
+    encoder_output = whisper_model.encode(features)
+    tokenizer = Tokenizer(whisper_model.hf_tokenizer, whisper_model.model.is_multilingual, task="transcribe", language="en")
+    prompt = whisper_model.get_prompt(tokenizer, previous_tokens=[], without_timestamps=True)
+    prompts = [list(prompt) for _ in clips]
+    if whisper_model.model.is_multilingual:
+        # Swap the placeholder language token for each clip's own detected language.
+        language_index = prompt.index(tokenizer.language)
+        for prompt_tokens, clip_languages in zip(prompts, whisper_model.model.detect_language(encoder_output)):
+            prompt_tokens[language_index] = tokenizer.tokenizer.token_to_id(clip_languages[0][0])
+    results = whisper_model.model.generate(
+        encoder_output, prompts, beam_size=1, return_scores=True, return_no_speech_prob=True
+    )
+    texts = []
+    for clip, result in zip(clips, results):
+        tokens = result.sequences_ids[0]
+        avg_logprob = result.scores[0] * len(tokens) / (len(tokens) + 1)
+        # Same silence rule faster-whisper's transcribe() applies.
+        if result.no_speech_prob > WHISPER_NO_SPEECH_THRESHOLD and avg_logprob < WHISPER_LOG_PROB_THRESHOLD:
+            texts.append("")
+            continue
+        text = tokenizer.decode(tokens).strip()
+        if get_compression_ratio(text) > WHISPER_COMPRESSION_RATIO_THRESHOLD or avg_logprob < WHISPER_LOG_PROB_THRESHOLD:
+            # Likely a greedy-decoding loop or noise; redo this clip with the safeguards.
+            text = transcribe_single_audio(clip)
+        texts.append(text)
+    return texts
+
+def transcribe_single_audio(audio: np.ndarray) -> str:
+    """Transcribes audio on its own through faster-whisper's full pipeline, with VAD and temperature fallback."""
+    # Segments are generated lazily, so consume them inside the worker thread.
+    segments, _ = whisper_model.transcribe(audio, beam_size=1, vad_filter=True)
+    return "".join(segment.text for segment in segments).strip()
+
+async def whisper_batcher() -> None:
+    """Collects voice messages arriving within a short window and transcribes them as one batch."""
     loop = asyncio.get_running_loop()
-    result = await loop.run_in_executor(
-        None, lambda: whisper_model.transcribe(audio_file_path, fp16=False)
+    while True:
+        batch = [await whisper_queue.get()]
+        await asyncio.sleep(WHISPER_BATCH_WINDOW_SECONDS)
+        while len(batch) < WHISPER_MAX_BATCH_SIZE and not whisper_queue.empty():
+            batch.append(whisper_queue.get_nowait())
+        # Skip requests that were cancelled while waiting.
+        batch = [(clip, future) for clip, future in batch if not future.done()]
+        if not batch:
+            continue
+        try:
+            texts = await loop.run_in_executor(whisper_executor, transcribe_batch, [clip for clip, _ in batch])
+        except Exception as e:
+            logger.error(f"Error in batched transcription: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        for (_, future), text in zip(batch, texts):
+            if not future.done():
+                future.set_result(text)
+
+async def transcribe_voice(audio: io.BytesIO | np.ndarray) -> str:
+    """Transcribes audio to text; clips up to 30 s are batched with other in-flight voice messages."""
+    loop = asyncio.get_running_loop()
+    if not isinstance(audio, np.ndarray):
+        audio = await loop.run_in_executor(None, decode_audio, audio)
+    if len(audio) > WHISPER_CHUNK_SAMPLES:
+        return await loop.run_in_executor(whisper_executor, transcribe_single_audio, audio)
+    future = loop.create_future()
+    whisper_queue.put_nowait((audio, future))
+    return await future
+
+async def warm_up_whisper() -> None:
+    """Runs silence through both transcription paths so the first real messages don't pay for lazy initialization."""
+    await asyncio.gather(
+        transcribe_voice(np.zeros(WHISPER_SAMPLE_RATE, dtype=np.float32)),
+        transcribe_voice(np.zeros(WHISPER_CHUNK_SAMPLES + WHISPER_SAMPLE_RATE, dtype=np.float32)),
     )
-    return result["text"]
 
-async def text_to_speech(text: str, lang: str) -> str | None:
-    """Converts text to speech and saves it as an OGG file asynchronously."""
-    lang_code = lang_code_map.get(lang.split()[0], 'en')
-    output_path = f"response_{secrets.token_hex(4)}.ogg"
+async def text_to_speech(text: str, lang: str) -> bytes | None:
+    """Converts text to speech with gTTS and encodes it in memory as an OGG/Opus voice note."""
+    lang_code = LANG_CODE_MAP.get(lang.split()[0], 'en')
+
+    def _synthesize() -> bytes:
+        mp3_buffer = io.BytesIO()
+        gTTS(text=text, lang=lang_code, slow=False).write_to_fp(mp3_buffer)
+        return mp3_buffer.getvalue()
+
     try:
-        tts = gTTS(text=text, lang=lang_code, slow=False)
         loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, tts.save, output_path)
-        return output_path
+        mp3_bytes = await loop.run_in_executor(None, _synthesize)
+        # Telegram voice notes must be OGG/Opus; ffmpeg transcodes pipe to pipe.
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-loglevel", "error", "-f", "mp3", "-i", "pipe:0",
+            "-c:a", "libopus", "-b:a", "32k", "-f", "ogg", "pipe:1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        ogg_bytes, stderr = await process.communicate(mp3_bytes)
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg exited with {process.returncode}: {stderr.decode().strip()}")
+        return ogg_bytes
     except Exception as e:
         logger.error(f"Error in text-to-speech conversion: {e}")
         return None
 
+async def send_voice_replies(bot: Bot, chat_id: int, tts_tasks: asyncio.Queue) -> int:
+    """Sends synthesized voice notes in order as they become ready. Returns how many were sent."""
+    sent = 0
+    while (tts_task := await tts_tasks.get()) is not None:
+        if not tts_task.done():
+            await bot.send_chat_action(chat_id=chat_id, action=ChatAction.RECORD_VOICE)
+        audio = await tts_task
+        if audio:
+            await bot.send_voice(chat_id=chat_id, voice=audio)
+            sent += 1
+    return sent
+
 # --- Telegram Handlers ---
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends a welcome message for the /start command."""
-    conversation_history[update.effective_chat.id].clear()
+    await clear_history(update.effective_chat.id)
     await update.message.reply_text(
         "Hey! I'm NomadAI. Send me a voice message in any language about what you want to do or see in Delhi!"
     )
@@ -221,17 +575,19 @@ async def feedback_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Main handler for processing voice messages with advanced logic."""
     chat_id = update.effective_chat.id
-    audio_file_path = None
-    response_audio_path = None
+    sender_task = None
+    tts_tasks = []
     try:
         await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.RECORD_VOICE)
         
         voice = update.message.voice
         file = await context.bot.get_file(voice.file_id)
-        audio_file_path = f"{voice.file_id}.ogg"
-        await file.download_to_drive(audio_file_path)
+        # Keep the voice note in memory; faster-whisper decodes file-like objects directly.
+        audio = io.BytesIO()
+        await file.download_to_memory(audio)
+        audio.seek(0)
 
-        user_query_text = await transcribe_voice(audio_file_path)
+        user_query_text = await transcribe_voice(audio)
         if not user_query_text:
             await update.message.reply_text("Sorry, I couldn't understand that. Could you please speak a bit more clearly?")
             return
@@ -239,41 +595,63 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
         logger.info(f"User ({chat_id}): {user_query_text}")
         await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
 
-        # --- Asynchronous Data Gathering ---
-        time_task = get_current_time_in_delhi()
-        lang_vibe_task = detect_language_and_vibe(user_query_text)
-        places_task = get_places_data(user_query_text)
-        
-        time_info, (language, vibe), places_data = await asyncio.gather(
-            time_task, lang_vibe_task, places_task
-        )
-        logger.info(f"Context for {chat_id}: Lang={language}, Vibe={vibe}, Time={time_info}")
-        
-        # --- AI Response Generation ---
-        history = list(conversation_history[chat_id])
-        master_prompt = generate_master_prompt(language, user_query_text, places_data, history, time_info, vibe)
-        ai_response_text = await asyncio.to_thread(get_ai_response, master_prompt)
+        greeting = match_greeting(user_query_text)
+        if greeting:
+            # A bare greeting needs no language detection, intent detection, Places data, or 70B model.
+            language = greeting_language(greeting)
+            reply_sentences = greeting_reply(language)
+            logger.info(f"Context for {chat_id}: Lang={language}, Greeting=True")
+        else:
+            # --- Asynchronous Data Gathering ---
+            time_info, analysis = await asyncio.gather(
+                get_current_time_in_delhi(), detect_language_and_vibe_intent(user_query_text)
+            )
+            language, vibe = analysis["language"], analysis["vibe"]
+            is_location_query = analysis["is_location_query"]
+            # Greetings and follow-ups don't need a Places round-trip.
+            if is_location_query:
+                places_data = await get_places_data(analysis["search_query"])
+            else:
+                places_data = "Not needed for this query."
+            logger.info(f"Context for {chat_id}: Lang={language}, Vibe={vibe}, Time={time_info}, Location={is_location_query}")
+
+            # --- AI Response Generation ---
+            history = await get_history(chat_id)
+            master_prompt = generate_master_prompt(language, user_query_text, places_data, history, time_info, vibe, is_location_query)
+            reply_sentences = stream_ai_response(master_prompt)
+
+        # --- Response Delivery ---
+        # Each sentence is synthesized as soon as it is available, so the first
+        # voice note goes out while the rest of the reply is still being generated.
+        tts_queue: asyncio.Queue = asyncio.Queue()
+        sender_task = asyncio.create_task(send_voice_replies(context.bot, chat_id, tts_queue))
+        response_sentences = []
+        async for sentence in reply_sentences:
+            response_sentences.append(sentence)
+            tts_task = asyncio.create_task(text_to_speech(sentence, language))
+            tts_tasks.append(tts_task)
+            tts_queue.put_nowait(tts_task)
+        tts_queue.put_nowait(None)
+        voice_notes_sent = await sender_task
+
+        ai_response_text = " ".join(response_sentences)
         logger.info(f"Bot ({chat_id}): {ai_response_text}")
 
         # Update conversation history
-        conversation_history[chat_id].append((user_query_text, ai_response_text))
+        await append_history(chat_id, user_query_text, ai_response_text)
 
-        # --- Send Response ---
-        response_audio_path = await text_to_speech(ai_response_text, language)
-        if response_audio_path:
-            await context.bot.send_voice(chat_id=chat_id, voice=open(response_audio_path, 'rb'))
-        else:
+        if not voice_notes_sent:
             await update.message.reply_text("Sorry, I'm feeling a bit speechless right now. Please try again.")
 
     except Exception as e:
         logger.error(f"An unexpected error occurred in handle_voice_message: {e}", exc_info=True)
         await update.message.reply_text("Oops! Something went wrong on my end. Please try again in a moment.")
     finally:
-        # Robust cleanup of temporary audio files
-        if audio_file_path and os.path.exists(audio_file_path):
-            os.remove(audio_file_path)
-        if response_audio_path and os.path.exists(response_audio_path):
-            os.remove(response_audio_path)
+        # Don't leave synthesis or sending running for a failed request.
+        if sender_task and not sender_task.done():
+            sender_task.cancel()
+        for tts_task in tts_tasks:
+            tts_task.cancel()
 
 # --- FastAPI Webhook Endpoint ---
 
@@ -285,7 +663,7 @@ async def process_telegram_update(request: Request):
         raise HTTPException(status_code=403, detail="Invalid secret token")
     try:
         data = await request.json()
-        update = Update.de_json(data, bot)
+        update = Update.de_json(data, telegram_app.bot)
         await telegram_app.process_update(update)
         return Response(status_code=200)
     except Exception as e:
@@ -295,20 +673,14 @@ async def process_telegram_update(request: Request):
 @app.on_event("startup")
 async def startup_event():
     """Actions to take on application startup."""
-    global persona_instruction_map, lang_code_map
-    persona_instruction_map = {
-        "hindi": "Your persona is 'Dilli Dost'. You are a witty, friendly best friend. You MUST speak in Hinglish... Be enthusiastic and informal.",
-        "hinglish": "Your persona is 'Dilli Dost'. You are a witty, friendly best friend. You MUST speak in Hinglish... Be enthusiastic and informal.",
-        "french": "Your persona is 'Votre ami à Delhi'. Be warm, encouraging, and polite...",
-        "spanish": "Your persona is 'Tu amigo en Delhi'. Be friendly, enthusiastic, and helpful...",
-        "default": "Your persona is a friendly and knowledgeable local guide. Be clear, helpful, and welcoming..."
-    }
-    lang_code_map = {"hindi": "hi", "hinglish": "hi", "french": "fr", "spanish": "es"}
-
     logger.info("Application startup...")
+    app.state.whisper_batcher = asyncio.create_task(whisper_batcher())
+    await warm_up_whisper()
+    logger.info("Whisper model warmed up.")
     telegram_app.add_handler(CommandHandler("start", start_command))
     telegram_app.add_handler(CommandHandler("feedback", feedback_command))
     telegram_app.add_handler(MessageHandler(filters.VOICE & ~filters.COMMAND, handle_voice_message))
+    await telegram_app.initialize()
 
     webhook_url = os.getenv("WEBHOOK_URL")
     if webhook_url:
@@ -317,6 +689,15 @@ async def startup_event():
     else:
         logger.warning("WEBHOOK_URL environment variable not set. Webhook not configured.")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Actions to take on application shutdown."""
+    await telegram_app.shutdown()
+    await http_client.aclose()
+    await redis_client.aclose()
+    app.state.whisper_batcher.cancel()
+    whisper_executor.shutdown(wait=False)
+
 @app.get("/health")
 async def health_check():
     """A simple health check endpoint to verify the service is running."""